@@ -1,5 +1,6 @@
 from .core import File, Entity, Layout, Tag, Domain, merge_layouts
-from .extensions import (replace_entities, build_path, write_contents_to_file)
+from .extensions import (replace_entities, build_path, build_paths,
+                         write_contents_to_file)
 
 __all__ = [
     'File',
@@ -9,6 +10,7 @@ __all__ = [
     'Domain',
     'replace_entities',
     'build_path',
+    'build_paths',
     'write_contents_to_file',
     'merge_layouts'
 ]
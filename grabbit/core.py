@@ -1,33 +1,160 @@
 import json
 import os
 import re
+import sys
 from collections import defaultdict, OrderedDict, namedtuple
 from grabbit.external import six, inflect
-from grabbit.utils import natural_sort, listify
-from grabbit.extensions.writable import build_path, write_contents_to_file
-from os.path import (join, basename, dirname, abspath, split, exists, isdir,
+from grabbit.utils import (natural_sort, listify, compile_regex,
+                           literal_prefix, has_leading_wildcard)
+from grabbit.extensions.writable import (build_path, build_paths,
+                                         write_contents_to_file)
+from os.path import (join, basename, dirname, abspath, split, exists,
                      relpath, isabs)
-from functools import partial
+from functools import partial, lru_cache
+from operator import methodcaller
 from copy import copy, deepcopy
 import warnings
 from keyword import iskeyword
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 __all__ = ['File', 'Entity', 'Layout']
 
+# Characters that give a query string special meaning as a regex
+_REGEX_META = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+# Entity placeholders (e.g., '{subject}') in directory templates
+_TEMPLATE_ENTITIES = re.compile(r'\{(.*?)\}')
+
+
+# Numbered backreferences and '(?...)' extensions (inline flags,
+# conditionals, named groups and references), which can change meaning when
+# merged into a larger pattern: group numbers shift, and on Python < 3.11 a
+# mid-pattern inline flag silently applies to the whole pattern
+_UNMERGEABLE = re.compile(r'\\[1-9]|\(\?')
+
+
+@lru_cache(maxsize=None)
+def _compile_patterns(patterns):
+    ''' Compiles (and caches) a tuple of include/exclude regexes. Whenever
+    possible they're merged into a single alternation, so each path is
+    searched once rather than once per regex. Returns a tuple of compiled
+    patterns, any of which matching counts as a hit. '''
+    if len(patterns) > 1 and \
+            not any(_UNMERGEABLE.search(p) for p in patterns):
+        return (re.compile('|'.join('(?:%s)' % p for p in patterns)),)
+    return tuple(re.compile(p) for p in patterns)
+
+
+@lru_cache(maxsize=None)
+def _get_slots(cls):
+    ''' Returns the names of all slots declared by a class and its bases
+    (excluding __dict__ and __weakref__). '''
+    return tuple(attr for klass in cls.__mro__
+                 for attr in listify(klass.__dict__.get('__slots__', []))
+                 if attr not in ('__dict__', '__weakref__'))
+
+
+@lru_cache(maxsize=None)
+def _get_tuple_class(fields):
+    ''' Returns a namedtuple class for the given field names. Creating the
+    class is expensive, so one is shared by all Files with the same entities.
+    '''
+    return namedtuple('File', ('filename',) + fields)
+
+
+def _query_key(val):
+    ''' Returns a hashable key for a value passed to Layout.get(), tagged
+    with its type (e.g., 1 and True must not share a key, as they're matched
+    differently). Raises TypeError for values that can't be keyed. '''
+    if isinstance(val, (list, tuple)):
+        return (type(val),) + tuple(_query_key(v) for v in val)
+    if val is None or isinstance(val, six.string_types + (int, float)):
+        return (type(val), val)
+    raise TypeError("Can't use %r as a query key." % (val,))
+
+
+def _compile_filters(entities=None, extensions=None, regex_search=False):
+    ''' Compiles query arguments into the regexes used by File._match_compiled.
+
+    Args:
+        entities (dict): A dictionary of entity names -> values to match.
+        extensions (str, list): One or more file extensions to allow.
+        regex_search (bool): Whether to require exact match (False) or regex
+            search (True) when comparing the query string to each entity.
+    Returns:
+        A tuple of (patterns, extensions), where patterns is a list of
+        (name, compiled regex or None) pairs and extensions is a function that
+        tests a filename against the allowed extensions, or None.
+    '''
+    def make_patt(x):
+        patt = '%s' % x
+        if isinstance(x, (int, float)):
+            # allow for leading zeros if a number was specified
+            # regardless of regex_search
+            patt = '0*' + patt
+        if not regex_search:
+            patt = '^%s$' % patt
+        return patt
+
+    patterns = []
+    if entities is not None:
+        for name, val in entities.items():
+            if val is not None:
+                val = re.compile('|'.join(make_patt(x) for x in listify(val)))
+            patterns.append((name, val))
+
+    if extensions is not None:
+        extensions = listify(extensions)
+        if extensions and not any(_REGEX_META.search(e.replace('.', ''))
+                                  for e in extensions):
+            # Plain extensions can be tested without the regex engine
+            extensions = methodcaller('endswith', tuple(extensions))
+        else:
+            extensions = re.compile('(' + '|'.join(extensions) + ')$').search
+
+    return patterns, extensions
+
 
 class File(object):
 
+    # Layouts can hold a very large number of Files, so avoid a per-instance
+    # __dict__. Subclasses that don't define __slots__ still get one.
+    __slots__ = ('path', 'filename', 'dirname', 'tags', 'domains')
+
     def __init__(self, filename, domains=None):
         """
         Represents a single file.
         """
         self.path = filename
-        self.filename = basename(self.path)
-        self.dirname = dirname(self.path)
+        dirname, self.filename = split(filename)
+        # Every file in a directory shares the same dirname; store it once
+        self.dirname = sys.intern(dirname)
         self.tags = {}
         self.domains = domains or []
 
+    def __copy__(self):
+        # Much cheaper than copy's generic __reduce_ex__ protocol, which
+        # matters because get() copies every File it returns when the Layout
+        # uses relative paths.
+        cls = self.__class__
+        new = cls.__new__(cls)
+        if cls is File:
+            slots = File.__slots__
+        else:
+            # Subclasses may add slots of their own, or a __dict__
+            slots = _get_slots(cls)
+            if hasattr(self, '__dict__'):
+                new.__dict__.update(self.__dict__)
+        for attr in slots:
+            if hasattr(self, attr):
+                setattr(new, attr, getattr(self, attr))
+        return new
+
     @property
     def entities(self):
         return {k: v.value for k, v in self.tags.items()}
@@ -48,43 +175,44 @@ class File(object):
         Returns:
             True if _all_ entities and extensions match; False otherwise.
         """
+        patterns, extensions = _compile_filters(entities, extensions,
+                                                regex_search)
+        if domains is not None:
+            domains = set(listify(domains))
+        return self._match_compiled(patterns, extensions, domains)
+
+    def _match_compiled(self, patterns, extensions=None, domains=None):
+        """
+        Checks whether the file matches all of the passed precompiled entity
+        patterns and extensions (see _compile_filters).
+
+        Args:
+            patterns (list): A list of (entity name, compiled regex) pairs.
+                A regex of None requires the entity to be absent.
+            extensions (callable): A function that returns True for filenames
+                with an allowed extension.
+            domains (set): One or more domains the file must match.
+        Returns:
+            True if _all_ entities and extensions match; False otherwise.
+        """
         if extensions is not None:
-            if isinstance(extensions, six.string_types):
-                extensions = [extensions]
-            extensions = '(' + '|'.join(extensions) + ')$'
-            if re.search(extensions, self.filename) is None:
+            if not extensions(self.filename):
                 return False
 
         if domains is not None:
-            domains = listify(domains)
-            if not set(self.domains) & set(domains):
+            if domains.isdisjoint(self.domains):
                 return False
 
-        if entities is not None:
+        for name, patt in patterns:
 
-            for name, val in entities.items():
-
-                if (name not in self.tags) ^ (val is None):
-                    return False
-
-                if val is None:
-                    continue
-
-                def make_patt(x):
-                    patt = '%s' % x
-                    if isinstance(x, (int, float)):
-                        # allow for leading zeros if a number was specified
-                        # regardless of regex_search
-                        patt = '0*' + patt
-                    if not regex_search:
-                        patt = '^%s$' % patt
-                    return patt
+            if (name not in self.tags) ^ (patt is None):
+                return False
 
-                ent_patts = [make_patt(x) for x in listify(val)]
-                patt = '|'.join(ent_patts)
+            if patt is None:
+                continue
 
-                if re.search(patt, str(self.tags[name].value)) is None:
-                    return False
+            if patt.search(str(self.tags[name].value)) is None:
+                return False
         return True
 
     def as_named_tuple(self):
@@ -92,7 +220,7 @@ class File(object):
         Returns the File as a named tuple. The full path plus all entity
         key/value pairs are returned as attributes.
         """
-        keys = list(self.entities.keys())
+        keys = list(self.tags.keys())
         replaced = []
         for i, k in enumerate(keys):
             if iskeyword(k):
@@ -103,9 +231,8 @@ class File(object):
             warnings.warn("Entity names cannot be reserved keywords when "
                           "representing a File as a namedtuple. Replacing "
                           "entities %s with safe versions %s." % (keys, safe))
-        entities = dict(zip(keys, self.entities.values()))
-        _File = namedtuple('File', 'filename ' + ' '.join(entities.keys()))
-        return _File(filename=self.path, **entities)
+        _File = _get_tuple_class(tuple(keys))
+        return _File(self.path, *[t.value for t in self.tags.values()])
 
     def copy(self, path_patterns, symbolic_link=False, root=None,
              conflicts='fail'):
@@ -113,10 +240,17 @@ class File(object):
         filename defined by the current File's entities and the specified
         path_patterns. '''
         new_filename = build_path(self.entities, path_patterns)
+        return self._copy_to(new_filename, symbolic_link, root, conflicts)
+
+    def _copy_to(self, new_filename, symbolic_link=False, root=None,
+                 conflicts='fail'):
+        ''' Copies the File to new_filename, as built from the File's
+        entities by build_path() (see copy()). Does nothing if new_filename is
+        empty. '''
         if not new_filename:
             return None
 
-        if new_filename[-1] == os.sep:
+        if new_filename.endswith(os.sep):
             new_filename += self.filename
 
         if isabs(self.path) or root is None:
@@ -129,15 +263,12 @@ class File(object):
                              "exist." % path)
 
         if symbolic_link:
-            contents = None
-            link_to = path
+            link_to, copy_from = path, None
         else:
-            with open(path, 'r') as f:
-                contents = f.read()
-            link_to = None
+            link_to, copy_from = None, path
 
-        write_contents_to_file(new_filename, contents=contents,
-                               link_to=link_to, content_mode='text', root=root,
+        write_contents_to_file(new_filename, link_to=link_to,
+                               copy_from=copy_from, root=root,
                                conflicts=conflicts)
 
 
@@ -191,6 +322,10 @@ Tag = namedtuple('Tag', ['entity', 'value'])
 
 class Entity(object):
 
+    __slots__ = ('name', 'pattern', 'domain', 'mandatory', 'directory',
+                 'map_func', 'kwargs', 'dtype', 'files', 'regex', '_prefix',
+                 '_anchored', 'id', 'aliases')
+
     def __init__(self, name, pattern=None, domain=None, mandatory=False,
                  directory=None, map_func=None, dtype=None, aliases=None,
                  **kwargs):
@@ -221,7 +356,7 @@ class Entity(object):
                              "pattern or mapping function provided. Either the"
                              " 'pattern' or the 'map_func' arguments must be "
                              "set." % name)
-        self.name = name
+        self.name = sys.intern(name)
         self.pattern = pattern
         self.domain = domain
         self.mandatory = mandatory
@@ -237,7 +372,9 @@ class Entity(object):
         self.dtype = dtype
 
         self.files = {}
-        self.regex = re.compile(pattern) if pattern is not None else None
+        self.regex = compile_regex(pattern) if pattern is not None else None
+        self._prefix = literal_prefix(pattern) if pattern is not None else ''
+        self._anchored = pattern is not None and has_leading_wildcard(pattern)
         domain_name = getattr(domain, 'name', '')
         self.id = '.'.join([domain_name, name])
         aliases = [] if aliases is None else listify(aliases)
@@ -253,11 +390,24 @@ class Entity(object):
         result = cls.__new__(cls)
         memo[id(self)] = result
 
-        for k, v in self.__dict__.items():
-            new_val = getattr(self, k) if k == 'regex' else deepcopy(v, memo)
+        # Subclasses may add slots of their own, or a __dict__
+        state = {k: getattr(self, k) for k in _get_slots(cls)
+                 if hasattr(self, k)}
+        state.update(getattr(self, '__dict__', {}))
+        for k, v in state.items():
+            new_val = v if k == 'regex' else deepcopy(v, memo)
             setattr(result, k, new_val)
         return result
 
+    def _search(self, string):
+        ''' Search a string with the Entity's regex, skipping the regex engine
+        entirely when the pattern's literal prefix is absent. '''
+        if self._prefix not in string:
+            return None
+        if self._anchored and '\n' not in string:
+            return self.regex.match(string)
+        return self.regex.search(string)
+
     def match_file(self, f, update_file=False):
         """
         Determine whether the passed file matches the Entity.
@@ -270,8 +420,11 @@ class Entity(object):
         if self.map_func is not None:
             val = self.map_func(f)
         else:
-            m = self.regex.search(f.path)
+            m = self._search(f.path)
             val = m.group(1) if m is not None else None
+            if val is not None:
+                # Values repeat across many files; interning stores each once
+                val = sys.intern(val)
 
         return self._astype(val)
 
@@ -304,7 +457,8 @@ class Layout(object):
     def __init__(self, paths, root=None, index=None,
                  dynamic_getters=False, absolute_paths=True,
                  regex_search=False, entity_mapper=None, path_patterns=None,
-                 config_filename='layout.json', include=None, exclude=None):
+                 config_filename='layout.json', include=None, exclude=None,
+                 max_workers=None, extensions=None):
         """
         A container for all the files and metadata found at the specified path.
 
@@ -329,7 +483,12 @@ class Layout(object):
             index (str): Optional path to a saved index file. If a valid value
                 is passed, this index is used to populate Files and Entities,
                 and the normal indexing process (which requires scanning all
-                files in the project) is skipped.
+                files in the project) is skipped. If no file exists at the
+                path yet, the project is indexed as usual and the index is
+                saved there, so that it can be reused next time (unless
+                directory-specific config files were found, as those can't be
+                restored from a saved index). Delete the file to pick up
+                changes to the project or config.
             dynamic_getters (bool): If True, a get_{entity_name}() method will
                 be dynamically added to the Layout every time a new Entity is
                 created. This is implemented by creating a partial function of
@@ -370,6 +529,15 @@ class Layout(object):
                 globally filter files when indexing. If a file or directory
                 *must* matches any of the passed values, it will be dropped
                 from indexing. Cannot be used together with 'include'.
+            max_workers (int): Optional number of threads used to read
+                directory listings concurrently while indexing, and to copy
+                files in copy_files(). Can speed up both considerably on
+                network filesystems. If None or 1 (default), everything is
+                done serially.
+            extensions (str, list): Optional file extension(s) (e.g.,
+                '.nii.gz') to restrict indexing to. Files ending in any other
+                extension are skipped before any include/exclude or entity
+                regex is run on them. If None (default), all files are indexed.
         """
 
         if include is not None and exclude is not None:
@@ -388,11 +556,16 @@ class Layout(object):
         self.include = listify(include or [])
         self.exclude = listify(exclude or [])
         self.absolute_paths = absolute_paths
+        self.max_workers = max_workers
+        self.extensions = tuple(listify(extensions)) if extensions else None
         if root is None:
             root = '/'
         self.root = abspath(root)
 
         self._domain_map = {}
+        self._value_index = None
+        self._dir_patterns = {}
+        self._parsed_entities = {}
 
         # Extract path --> domain mapping
         self._paths_to_index = {}
@@ -417,6 +590,17 @@ class Layout(object):
 
         if index is None:
             self.index()
+        elif not exists(index):
+            init_domains = set(self.domains)
+            self.index()
+            # load_index() can't restore domains from directory-specific
+            # config files, so an index that depends on them isn't saved
+            if set(self.domains) == init_domains:
+                self.save_index(index)
+            else:
+                warnings.warn("Not saving the index to %s, because it uses "
+                              "directory-specific config files, which "
+                              "load_index() can't restore." % index)
         else:
             self.load_index(index)
 
@@ -483,14 +667,15 @@ class Layout(object):
         for dom in domains:
             # If file matches any include regex, then True
             if dom.include:
-                for regex in dom.include:
-                    if re.search(regex, filename):
+                for regex in _compile_patterns(tuple(dom.include)):
+                    if regex.search(filename):
                         return True
                 return False
             else:
                 # If file matches any exclude regex, then False
-                for regex in dom.exclude:
-                    if re.search(regex, filename, flags=re.UNICODE):
+                for regex in _compile_patterns(tuple(dom.exclude)):
+                    # (str patterns always match with re.UNICODE)
+                    if regex.search(filename):
                         return False
         return True
 
@@ -509,8 +694,16 @@ class Layout(object):
         return True
 
     def _get_files(self, root):
-        ''' Returns all files in directory (non-recursively). '''
-        return os.listdir(root)
+        ''' Returns all entries in directory (non-recursively), as a list of
+        (path, is_dir) tuples. Uses os.scandir so that the directory check
+        is answered from the cached d_type instead of an extra stat() call.
+
+        Note: this used to return a list of bare names (as os.listdir does).
+        Subclasses that override it must now return full paths paired with a
+        flag indicating whether each entry is a directory.
+        '''
+        with os.scandir(root) as entries:
+            return [(e.path, e.is_dir()) for e in entries]
 
     def _make_file_object(self, root, f):
         ''' Initialize a new File oject from a directory and filename. Extend
@@ -520,9 +713,86 @@ class Layout(object):
     def _reset_index(self):
         # Reset indexes
         self.files = {}
+        self._value_index = None
+        self._parsed_entities = {}
         for ent in self.entities.values():
             ent.files = {}
 
+    def _get_value_index(self):
+        ''' Returns an inverted index over entity values, as a tuple of (files,
+        index, hits, results), where files is a list of all Files and index
+        maps entity names to a dict of (stringified) values -> set of positions
+        in files. hits memoizes the positions matched by each (entity name,
+        filter pattern) pair across get() calls, and results memoizes the
+        results of whole get() calls; both are cleared once they reach a size
+        limit. Built lazily and discarded whenever the set of indexed Files
+        (or entities) changes.
+        '''
+        if self._value_index is None:
+            files = list(self.files.values())
+            index = {}
+            for i, f in enumerate(files):
+                for name, tag in f.tags.items():
+                    values = index.setdefault(name, {})
+                    values.setdefault(str(tag.value), set()).add(i)
+            self._value_index = (files, index, {}, {})
+        return self._value_index
+
+    def _get_candidates(self, filters, patterns, regex_search):
+        ''' Uses the inverted value index to narrow down the Files that can
+        possibly match the passed entity filters. Plain string values (no regex
+        metacharacters) are looked up directly when exact matching is
+        requested; any other value is resolved by testing its compiled pattern
+        against the entity's unique values rather than against every File.
+
+        Args:
+            filters (dict): The entity names -> query values passed to get().
+            patterns (list): The (name, compiled regex) pairs returned by
+                _compile_filters for the same filters.
+            regex_search (bool): Whether regex search is used for matching.
+
+        Returns: a list of Files (in index order) that is guaranteed to contain
+            every matching File, or None if no filter could be looked up.
+        '''
+        if not filters:
+            return None
+
+        files, index, hits, _ = self._get_value_index()
+        candidates = None
+        for name, patt in patterns:
+            if patt is None:
+                continue
+            vals = listify(filters[name])
+            # An empty list of values compiles to a pattern that matches
+            # anything, so it can't be looked up directly
+            exact = bool(vals) and not regex_search and all(
+                isinstance(v, six.string_types) and
+                _REGEX_META.search(v) is None for v in vals)
+            # The same pattern can be resolved either way, so the memo key
+            # records which one was used
+            key = (name, patt.pattern, exact)
+            matches = hits.get(key)
+            if matches is None:
+                values = index.get(name, {})
+                matches = set()
+                if exact:
+                    for v in vals:
+                        matches |= values.get(v, set())
+                else:
+                    for v, positions in values.items():
+                        if patt.search(v) is not None:
+                            matches |= positions
+                # Bounded, like the get() results memo
+                if len(hits) >= 1024:
+                    hits.clear()
+                matches = hits[key] = frozenset(matches)
+            candidates = matches if candidates is None \
+                else candidates & matches
+
+        if candidates is None:
+            return None
+        return [files[i] for i in sorted(candidates)]
+
     def _index_file(self, root, f, domains, update_layout=True):
 
         # Create the file object--allows for subclassing
@@ -551,6 +821,7 @@ class Layout(object):
             f.domains = domains
 
         self.files[f.path] = f
+        self._value_index = None
 
         return f
 
@@ -573,42 +844,71 @@ class Layout(object):
 
         self._reset_index()
 
-        def _index_dir(dir_, domains):
+        # Directory listings are I/O-bound, so when more than one worker is
+        # requested they are fetched ahead of time on a thread pool. All
+        # matching and index updates still happen on the calling thread.
+        executor = None
+        if self.max_workers is not None and self.max_workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        def _index_dir(dir_, domains, listing=None):
 
-            contents = [join(dir_, f) for f in self._get_files(dir_)]
+            if listing is None:
+                contents = self._get_files(dir_)
+            else:
+                contents = listing.result()
 
             # Check for domain config file
             config_file = join(dir_, self.config_filename)
 
-            if exists(config_file):
+            if (config_file, False) in contents:
                 new_dom = self._get_or_load_domain(config_file)
                 if new_dom not in domains:
                     domains.append(new_dom)
-                contents.remove(config_file)
+                contents.remove((config_file, False))
 
-            contents = filter(lambda x: self._check_inclusions(x, domains),
-                              contents)
+            contents = [(f, is_dir) for f, is_dir in contents
+                        if (is_dir or self.extensions is None or
+                            f.endswith(self.extensions)) and
+                        self._check_inclusions(f, domains)]
 
             # If the directory was explicitly passed in Layout init,
             # overwrite the current set of domains with what was passed
             domains = self._paths_to_index.get(dir_, domains)
 
-            for f in contents:
+            # Validate subdirectories up front so their listings can be
+            # requested while the files in this directory are indexed.
+            subdirs = OrderedDict()
+            for full_path, is_dir in contents:
+                if is_dir and self._validate_dir(full_path):
+                    subdirs[full_path] = None
+                    if executor is not None:
+                        subdirs[full_path] = executor.submit(
+                            self._get_files, full_path)
+
+            # Listed paths are all dir_ joined with a name, so the name can be
+            # sliced off instead of splitting every path again.
+            prefix_len = len(join(dir_, ''))
+            dom_names = [d.name for d in domains]
 
-                full_path = join(dir_, f)
+            for full_path, is_dir in contents:
 
-                if isdir(full_path):
-                    if self._validate_dir(full_path):
-                        _index_dir(full_path, list(domains))
+                if is_dir:
+                    if full_path in subdirs:
+                        _index_dir(full_path, list(domains),
+                                   subdirs[full_path])
 
                 elif self._validate_file(full_path):
-                    _dir, _base = split(full_path)
-                    dom_names = [d.name for d in domains]
-                    self._index_file(_dir, _base, dom_names)
+                    self._index_file(dir_, full_path[prefix_len:], dom_names)
 
         # Index each directory
-        for path, domains in self._paths_to_index.items():
-            _index_dir(path, list(domains))
+        try:
+            for path, domains in self._paths_to_index.items():
+                _index_dir(path, list(domains))
+        finally:
+            if executor is not None:
+                executor.shutdown()
 
     def save_index(self, filename):
         ''' Save the current Layout's index to a .json file.
@@ -624,8 +924,17 @@ class Layout(object):
         for f in self.files.values():
             entities = {v.entity.id: v.value for k, v in f.tags.items()}
             data[f.path] = {'domains': f.domains, 'entities': entities}
-        with open(filename, 'w') as outfile:
-            json.dump(data, outfile)
+        contents = None
+        if orjson is not None:
+            # orjson is much faster, but only handles 64-bit ints
+            try:
+                contents = orjson.dumps(data)
+            except TypeError:
+                pass
+        if contents is None:
+            contents = json.dumps(data).encode('utf-8')
+        with open(filename, 'wb') as outfile:
+            outfile.write(contents)
 
     def load_index(self, filename, reindex=False):
         ''' Load the Layout's index from a plaintext file.
@@ -644,8 +953,8 @@ class Layout(object):
         where there aren't multiple layout specs within a project.
         '''
         self._reset_index()
-        with open(filename, 'r') as fobj:
-            data = json.load(fobj)
+        with open(filename, 'rb') as fobj:
+            data = (orjson or json).loads(fobj.read())
 
         for path, file in data.items():
 
@@ -680,6 +989,9 @@ class Layout(object):
 
         ent = Entity(domain=domain, **kwargs)
         domain.add_entity(ent)
+        self._dir_patterns = {}
+        self._value_index = None
+        self._parsed_entities = {}
 
         if ent.mandatory:
             self.mandatory.add(ent.id)
@@ -732,14 +1044,48 @@ class Layout(object):
         if regex_search is None:
             regex_search = self.regex_search
 
-        result = []
-        filters = {}
-        filters.update(kwargs)
+        # Identical queries are answered from the results of the first one,
+        # until the set of indexed Files changes
+        try:
+            key = (return_type, target, _query_key(extensions),
+                   _query_key(domains), regex_search, self.absolute_paths,
+                   self.root, tuple(sorted((k, _query_key(v))
+                                           for k, v in kwargs.items())))
+        except TypeError:
+            return self._get(return_type, target, extensions, domains,
+                             regex_search, kwargs)
+        results = self._get_value_index()[3]
+        if key not in results:
+            if len(results) >= 256:
+                results.clear()
+            results[key] = self._get(return_type, target, extensions,
+                                     domains, regex_search, kwargs)
+        return list(results[key])
+
+    def _get(self, return_type, target, extensions, domains, regex_search,
+             filters):
+        ''' Runs a get() query (see get() for arguments), without looking
+        up or memoizing its results. '''
+        # Compile the query once rather than once per file
+        patterns, ext_patt = _compile_filters(filters, extensions,
+                                              regex_search)
+        domain_set = None if domains is None else set(listify(domains))
+
+        # Entity filters with a value are resolved through the value index;
+        # those set to None require the entity to be absent.
+        excluded = set(k for k, v in filters.items() if v is None)
+
+        files = self._get_candidates(filters, patterns, regex_search)
+        if files is None:
+            files = self.files.values()
 
-        for filename, file in self.files.items():
-            if not file._matches(filters, extensions, domains, regex_search):
-                continue
-            result.append(file)
+        if not excluded and ext_patt is None and domain_set is None:
+            # Nothing left to filter on
+            result = list(files)
+        else:
+            result = [f for f in files
+                      if f.tags.keys().isdisjoint(excluded) and
+                      f._match_compiled((), ext_patt, domain_set)]
 
         # Convert to relative paths if needed
         if not self.absolute_paths:
@@ -759,37 +1105,47 @@ class Layout(object):
             return result
 
         else:
-            valid_entities = self.get_domain_entities(domains)
-
             if target is None:
                 raise ValueError('If return_type is "id" or "dir", a valid '
                                  'target entity must also be specified.')
-            result = [x for x in result if target in x.entities]
+            result = [x for x in result if target in x.tags]
 
             if return_type == 'id':
-                result = list(set([x.entities[target] for x in result]))
+                result = {x.tags[target].value for x in result}
                 return natural_sort(result)
 
             elif return_type == 'dir':
-                template = valid_entities[target].directory
-                if template is None:
-                    raise ValueError('Return type set to directory, but no '
-                                     'directory template is defined for the '
-                                     'target entity (\"%s\").' % target)
-                # Construct regex search pattern from target directory template
-                to_rep = re.findall('\{(.*?)\}', template)
-                for ent in to_rep:
-                    patt = valid_entities[ent].pattern
-                    template = template.replace('{%s}' % ent, patt)
-                template += '[^\%s]*$' % os.path.sep
-                matches = [f.dirname for f in result
-                           if re.search(template, f.dirname)]
-                return natural_sort(list(set(matches)))
+                regex = self._get_dir_regex(target, domains)
+                # Many files share a directory, so only test each one once
+                dirnames = set(f.dirname for f in result)
+                matches = [d for d in dirnames if regex.search(d)]
+                return natural_sort(matches)
 
             else:
                 raise ValueError("Invalid return_type specified (must be one "
                                  "of 'tuple', 'file', 'id', or 'dir'.")
 
+    def _get_dir_regex(self, target, domains=None):
+        ''' Returns the compiled regex that matches directories of the target
+        entity, built from the entity's directory template. Compiled patterns
+        are cached per target and set of domains. '''
+        key = (target, None if domains is None else tuple(listify(domains)))
+        if key not in self._dir_patterns:
+            valid_entities = self.get_domain_entities(domains)
+            template = valid_entities[target].directory
+            if template is None:
+                raise ValueError('Return type set to directory, but no '
+                                 'directory template is defined for the '
+                                 'target entity (\"%s\").' % target)
+            # Construct regex search pattern from target directory template
+            to_rep = _TEMPLATE_ENTITIES.findall(template)
+            for ent in to_rep:
+                patt = valid_entities[ent].pattern
+                template = template.replace('{%s}' % ent, patt)
+            template += '[^\%s]*$' % os.path.sep
+            self._dir_patterns[key] = compile_regex(template)
+        return self._dir_patterns[key]
+
     def unique(self, entity):
         """
         Return a list of unique values for the named entity.
@@ -825,7 +1181,7 @@ class Layout(object):
                 value for a given attribute.
         """
         try:
-            import pandas as pd
+            import pandas  # noqa: F401
         except ImportError:
             raise ImportError("What are you doing trying to export a Layout "
                               "as a pandas DataFrame when you don't have "
@@ -833,8 +1189,25 @@ class Layout(object):
         if kwargs:
             files = self.get(return_type='obj', **kwargs)
         else:
-            files = self.files.values()
-        data = pd.DataFrame.from_records([f.entities for f in files])
+            files = list(self.files.values())
+        return self._make_data_frame(files)
+
+    def _make_data_frame(self, files, dtype=None):
+        ''' Builds the DataFrame returned by as_data_frame() from a list of
+        Files. With dtype=object, entity values keep their types (otherwise,
+        e.g., int columns with missing values are converted to float). '''
+        import pandas as pd
+
+        # Build the frame column-wise from pre-sized lists, which is much
+        # cheaper than letting pandas infer a frame from one dict per file.
+        n_files = len(files)
+        columns = OrderedDict()
+        for i, f in enumerate(files):
+            for k, v in f.entities.items():
+                if k not in columns:
+                    columns[k] = [float('nan')] * n_files
+                columns[k][i] = v
+        data = pd.DataFrame(columns, index=range(n_files), dtype=dtype)
         data.insert(0, 'path', [f.path for f in files])
         return data
 
@@ -870,7 +1243,7 @@ class Layout(object):
 
         entities = {}
         for ent in self.entities.values():
-            m = ent.regex.search(path)
+            m = ent._search(path)
             if m:
                 entities[ent.name] = ent._astype(m.group(1))
 
@@ -879,19 +1252,20 @@ class Layout(object):
             for k in ignore_strict_entities:
                 entities.pop(k, None)
 
-        results = self.get(return_type='file', **kwargs)
+        results = self.get(return_type='obj', **kwargs)
 
         folders = defaultdict(list)
 
-        for filename in results:
-            f = self.get_file(filename)
+        for f in results:
             folders[f.dirname].append(f)
 
+        query_keys = set(entities.keys())
+
         def count_matches(f):
             f_ents = f.entities
-            keys = set(entities.keys()) & set(f_ents.keys())
+            keys = query_keys.intersection(f_ents)
             shared = len(keys)
-            return [shared, sum([entities[k] == f_ents[k] for k in keys])]
+            return [shared, sum(entities[k] == f_ents[k] for k in keys)]
 
         matches = []
 
@@ -909,17 +1283,20 @@ class Layout(object):
             search_paths.extend(path for path in unchecked if folders[path])
 
         for path in search_paths:
-            # Sort by number of matching entities. Also store number of
-            # common entities, for filtering when strict=True.
-            num_ents = [[f] + count_matches(f) for f in folders[path]]
+            # Only the folders actually searched need to be put in (natural)
+            # order, which decides between files with equally many matches.
+            files = natural_sort(folders[path], field='path')
+            # Count matching entities. Also store number of common entities,
+            # for filtering when strict=True.
+            num_ents = [[f] + count_matches(f) for f in files]
             # Filter out imperfect matches (i.e., where number of common
             # entities does not equal number of matching entities).
             if strict:
                 num_ents = [f for f in num_ents if f[1] == f[2]]
-            num_ents.sort(key=lambda x: x[2], reverse=True)
 
             if num_ents:
-                matches.append(num_ents[0][0])
+                # max() returns the first of several best matches
+                matches.append(max(num_ents, key=lambda x: x[2])[0])
 
             if not all_:
                 break
@@ -928,6 +1305,24 @@ class Layout(object):
                    for m in matches]
         return matches if all_ else matches[0] if matches else None
 
+    def __deepcopy__(self, memo):
+
+        cls = self.__class__
+        result = cls.__new__(cls)
+        memo[id(self)] = result
+
+        for k, v in self.__dict__.items():
+            # Derived caches are cheaper to rebuild on demand than to copy
+            # (and compiled re2 patterns can't be deep-copied anyway).
+            if k == '_value_index':
+                new_val = None
+            elif k in ('_dir_patterns', '_parsed_entities'):
+                new_val = {}
+            else:
+                new_val = deepcopy(v, memo)
+            setattr(result, k, new_val)
+        return result
+
     def clone(self):
         return deepcopy(self)
 
@@ -942,7 +1337,21 @@ class Layout(object):
                        % list(self.domains.keys()))
                 raise ValueError(msg)
             domains = list(self.domains.keys())
-        result = self._index_file(root, f, domains, update_layout=False)
+
+        # The same filenames tend to be parsed over and over, so the parsed
+        # Files are cached (up to a limit) until the index or the set of
+        # entities changes.
+        key = (filename, tuple(listify(domains)))
+        result = self._parsed_entities.get(key)
+        if result is None:
+            if len(self._parsed_entities) >= 4096:
+                self._parsed_entities = {}
+            result = self._index_file(root, f, domains, update_layout=False)
+            self._parsed_entities[key] = result
+        elif self.files.get(result.path) is not result:
+            # Like _index_file(), register the parsed File with the Layout
+            self.files[result.path] = result
+            self._value_index = None
         return result.entities
 
     def build_path(self, source, path_patterns=None, strict=False,
@@ -980,14 +1389,56 @@ class Layout(object):
             source = source.entities
 
         if path_patterns is None:
-            if domains is None:
-                domains = list(self.domains.keys())
-            path_patterns = []
-            for dom in listify(domains):
-                path_patterns.extend(self.domains[dom].path_patterns)
+            path_patterns = self._get_path_patterns(domains)
 
         return build_path(source, path_patterns, strict)
 
+    def build_paths(self, data=None, path_patterns=None, strict=False,
+                    domains=None):
+        ''' Constructs target filenames for many sets of entities at once.
+        Much faster than calling build_path() on each one.
+
+        Args:
+            data (DataFrame): A pandas DataFrame with entity names in columns
+                and one set of entities per row. Missing values denote
+                entities that aren't set. Values are converted with str(),
+                so, e.g., int columns with missing values (which pandas
+                stores as float) render as '1.0'. If None, all Files in the
+                Layout are used. A 'path' column is ignored.
+            path_patterns (list): Optional path patterns to use to construct
+                the new file paths. If None, the Layout-defined patterns will
+                be used.
+            strict (bool): If True, all entities must be matched inside a
+                pattern in order to be a valid match. If False, extra entities
+                will be ignored so long as all mandatory entities are found.
+            domains (str, list): Optional name(s) of domain(s) to scan for
+                path patterns (see build_path).
+
+        Returns:
+            A pandas Series of constructed paths, with the same index as the
+            DataFrame. Rows for which no pattern matches are None.
+        '''
+        if data is None:
+            data = self._make_data_frame(list(self.files.values()),
+                                         dtype=object)
+
+        if 'path' in data.columns:
+            data = data.drop('path', axis=1)
+
+        if path_patterns is None:
+            path_patterns = self._get_path_patterns(domains)
+
+        return build_paths(data, path_patterns, strict)
+
+    def _get_path_patterns(self, domains=None):
+        ''' Returns the path patterns of the named domains, in order. '''
+        if domains is None:
+            domains = list(self.domains.keys())
+        path_patterns = []
+        for dom in listify(domains):
+            path_patterns.extend(self.domains[dom].path_patterns)
+        return path_patterns
+
     def copy_files(self, files=None, path_patterns=None, symbolic_links=True,
                    root=None, conflicts='fail', **get_selectors):
         """
@@ -1012,14 +1463,58 @@ class Layout(object):
                 to each file copy, starting with 0. Default is 'fail'.
             **get_selectors (kwargs): Optional key word arguments to pass into
                 a get() query.
+
+        Note: If the Layout was created with max_workers > 1, files are copied
+        on a thread pool, with all files going to the same target handled by
+        one worker. If any copy fails (e.g., because of a conflict when
+        conflicts='fail'), copies that haven't started yet are cancelled, the
+        ones in progress finish, and the error is re-raised. Files are
+        always copied serially when conflicts='append', since an appended
+        name can coincide with another file's target.
         """
         _files = self.get(return_type='objects', **get_selectors)
         if files:
-            _files = list(set(files).intersection(_files))
-
-        for f in _files:
-            f.copy(path_patterns, symbolic_link=symbolic_links,
-                   root=self.root, conflicts=conflicts)
+            # Match on paths, keeping the order in which files were passed
+            query = {f.path: f for f in _files}
+            _files = OrderedDict((f.path, query[f.path]) for f in files
+                                 if f.path in query)
+            _files = list(_files.values())
+
+        def _copy(indices):
+            for i in indices:
+                _files[i]._copy_to(targets[i], symbolic_link=symbolic_links,
+                                   root=self.root, conflicts=conflicts)
+
+        # Copy files in order of their targets, so that files going to the
+        # same directory are written together (keeping that directory's
+        # metadata in the OS cache). The sort is stable, so files that map to
+        # the same target keep their relative order. Each target is only
+        # built once, and reused for the copy itself.
+        targets = [build_path(f.entities, path_patterns) or '' for f in _files]
+        order = sorted(range(len(_files)), key=targets.__getitem__)
+
+        if self.max_workers is None or self.max_workers <= 1 or \
+                conflicts == 'append':
+            _copy(order)
+            return
+
+        # Files that map to the same target are handled in order by a single
+        # worker, so conflicts are resolved exactly as in the serial case.
+        groups = OrderedDict()
+        for i in order:
+            groups.setdefault(targets[i], []).append(i)
+
+        from concurrent.futures import (ThreadPoolExecutor, FIRST_EXCEPTION,
+                                        wait)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(_copy, g) for g in groups.values()]
+            # Stop scheduling further copies as soon as one fails
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in pending:
+                future.cancel()
+        for future in futures:
+            if not future.cancelled():
+                future.result()
 
     def write_contents_to_file(self, entities, path_patterns=None,
                                contents=None, link_to=None,
@@ -1102,4 +1597,7 @@ def merge_layouts(layouts):
             else:
                 layout.entities[k].files.update(v.files)
 
+    layout._value_index = None
+    layout._dir_patterns = {}
+    layout._parsed_entities = {}
     return layout
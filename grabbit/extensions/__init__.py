@@ -1,10 +1,12 @@
 # from .hdfs import HDFSLayout
-from .writable import replace_entities, build_path, write_contents_to_file
+from .writable import (replace_entities, build_path, build_paths,
+                       write_contents_to_file)
 
 
 __all__ = [
     # 'HDFSLayout',
     'replace_entities',
     'build_path',
+    'build_paths',
     'write_contents_to_file',
 ]
@@ -53,6 +53,6 @@ class HDFSLayout(Layout):
         return self._hdfs_client.walk(self.root)
 
     def _make_file_object(self, root, f):
-        filepath = str(psp.join(root, f))
-        with self._hdfs_client.read(filepath):
-            return File(filepath)
+        # Only the path is needed; the file was just listed, so there's no
+        # need to open a read handle (a remote round trip) to build a File.
+        return File(str(psp.join(root, f)))
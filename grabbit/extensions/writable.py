@@ -1,12 +1,149 @@
 import logging
 import os
 import re
+import shutil
 import sys
+from collections import namedtuple
+from functools import lru_cache
 from grabbit.utils import splitext
-from os.path import join, dirname, exists, islink, isabs, isdir
+from os.path import join, dirname, basename, exists, isabs, isdir
 from six import string_types
 
-__all__ = ['replace_entities', 'build_path', 'write_contents_to_file']
+__all__ = ['replace_entities', 'build_path', 'build_paths',
+           'write_contents_to_file']
+
+# Path pattern syntax: {entity<valid>|default} placeholders, [optional] parts
+_ENTITIES = re.compile(r'\{(.*?)\}')
+_ENTITY_PARTS = re.compile(r'([^|<]+)(<.*?>)?(\|.*)?')
+_DEFINED_ENTITIES = re.compile(r'\{(.*?)(?:<[^>]+>)?\}')
+_OPTIONAL = re.compile(r'\[(.*?)\]')
+
+
+@lru_cache(maxsize=None)
+def _compile(pattern):
+    ''' Compiles (and caches) a user-supplied valid-values regex. '''
+    return re.compile(pattern)
+
+
+# Sentinel for entities that weren't passed at all (as opposed to None)
+_MISSING = object()
+
+# A parsed {name<valid>|default} placeholder, and an [optional] portion
+_Placeholder = namedtuple('_Placeholder', ['name', 'valid', 'default'])
+_Optional = namedtuple('_Optional', ['tokens'])
+
+
+def _parse_placeholder(ent):
+    ''' Parses the text between the curly braces of a placeholder into a
+    _Placeholder. name is None if the placeholder can't be parsed. '''
+    match = _ENTITY_PARTS.search(ent)
+    if match is None:
+        return _Placeholder(None, None, None)
+    name, valid, default = match.groups()
+    # Entity names are interned (see Entity), so lookups of the interned
+    # name in an entities dict can short-circuit on identity
+    name = sys.intern(name)
+    valid = valid[1:-1] if valid is not None else valid
+    default = default[1:] if default is not None else default
+    return _Placeholder(name, valid, default)
+
+
+# Bounded, since build_path() also passes partially filled-in patterns
+@lru_cache(maxsize=1024)
+def _parse_entities(pattern):
+    ''' Parses (and caches) the entity placeholders in a path pattern, as a
+    tuple of (placeholder, name, valid, default) tuples. name is None if the
+    placeholder can't be parsed. '''
+    return tuple((ent,) + _parse_placeholder(ent)
+                 for ent in _ENTITIES.findall(pattern))
+
+
+def _tokenize(text):
+    ''' Splits text without [optional] portions into a list of literal
+    strings and _Placeholders. Returns None if the curly braces in the text
+    don't form simple, non-nested placeholders. '''
+    matches = list(_ENTITIES.finditer(text))
+    if not text.count('{') == text.count('}') == len(matches):
+        return None
+    tokens = []
+    pos = 0
+    for m in matches:
+        if m.start() > pos:
+            tokens.append(text[pos:m.start()])
+        tokens.append(_parse_placeholder(m.group(1)))
+        pos = m.end()
+    if pos < len(text):
+        tokens.append(text[pos:])
+    return tokens
+
+
+def _tokenize_path_pattern(pattern):
+    ''' Splits a path pattern into a tuple of literal strings, _Placeholders
+    and _Optional portions, so that it can be filled in with a single join.
+    Returns None if the pattern can't be split up cleanly (e.g., if square
+    brackets occur inside a placeholder). '''
+    tokens = []
+    pos = 0
+    for m in _OPTIONAL.finditer(pattern):
+        literal = _tokenize(pattern[pos:m.start()])
+        optional = _tokenize(m.group(1))
+        if literal is None or optional is None:
+            return None
+        tokens.extend(literal)
+        tokens.append(_Optional(tuple(optional)))
+        pos = m.end()
+    literal = _tokenize(pattern[pos:])
+    if literal is None:
+        return None
+    tokens.extend(literal)
+    return tuple(tokens)
+
+
+def _fill_tokens(tokens, entities):
+    ''' Fills in a tokenized path pattern (see _tokenize_path_pattern) with
+    the passed entities. Returns None if a placeholder can't be filled in. '''
+    chunks = []
+    for tok in tokens:
+        if isinstance(tok, _Placeholder):
+            name, valid, default = tok
+            if name is None:
+                return None
+            val = entities.get(name, _MISSING)
+            if val is _MISSING:
+                val = default
+            elif valid is not None and not _compile(valid).match(str(val)):
+                return None
+            if val is None:
+                return None
+            chunks.append(str(val))
+        elif isinstance(tok, _Optional):
+            chunks.append(_fill_tokens(tok.tokens, entities) or '')
+        else:
+            chunks.append(tok)
+    return ''.join(chunks)
+
+
+@lru_cache(maxsize=None)
+def _parse_path_pattern(pattern):
+    ''' Parses (and caches) a path pattern into a tuple of (defined, optional,
+    required, tokens), where defined is the set of entity names it contains,
+    optional is the tuple of its [optional] portions, and required is the set
+    of entity names that must be passed for the pattern to be filled in.
+    required is None if the pattern can't be ruled out up front, because
+    filling it in may replace invalid entity values with defaults as a side
+    effect. tokens is the tokenized pattern (see _tokenize_path_pattern), or
+    None if the pattern has such side effects or can't be tokenized. '''
+    defined = frozenset(_DEFINED_ENTITIES.findall(pattern))
+    optional = tuple(_OPTIONAL.findall(pattern))
+    required = frozenset(
+        name for _, name, _, default in
+        _parse_entities(_OPTIONAL.sub('', pattern)) if default is None)
+    if any(valid is not None and default is not None
+           for _, _, valid, default in _parse_entities(pattern)):
+        required = None
+    tokens = _tokenize_path_pattern(pattern) if required is not None \
+        else None
+    return defined, optional, required, tokens
 
 
 def replace_entities(entities, pattern):
@@ -27,24 +164,18 @@ def replace_entities(entities, pattern):
         A new string with the entity values inserted where entity names
         were denoted in the provided pattern.
     """
-    ents = re.findall('\{(.*?)\}', pattern)
     new_path = pattern
-    for ent in ents:
-        match = re.search('([^|<]+)(<.*?>)?(\|.*)?', ent)
-        if match is None:
+    for ent, name, valid, default in _parse_entities(pattern):
+        if name is None:
             return None
-        name, valid, default = match.groups()
-        default = default[1:] if default is not None else default
-
-        if name in entities:
-            if valid is not None:
-                ent_val = str(entities[name])
-                if not re.match(valid[1:-1], ent_val):
-                    if default is None:
-                        return None
-                    entities[name] = default
-
-        ent_val = entities.get(name, default)
+
+        ent_val = entities.get(name, _MISSING)
+        if ent_val is _MISSING:
+            ent_val = default
+        elif valid is not None and not _compile(valid).match(str(ent_val)):
+            if default is None:
+                return None
+            entities[name] = ent_val = default
         if ent_val is None:
             return None
         new_path = new_path.replace('{%s}' % ent, str(ent_val))
@@ -83,20 +214,28 @@ def build_path(entities, path_patterns, strict=False):
     # Loop over available patherns, return first one that matches all
     for pattern in path_patterns:
         # If strict, all entities must be contained in the pattern
+        defined, optional_patterns, required, tokens = \
+            _parse_path_pattern(pattern)
         if strict:
-            defined = re.findall('\{(.*?)(?:<[^>]+>)?\}', pattern)
-            if set(entities.keys()) - set(defined):
+            if set(entities.keys()) - defined:
                 continue
-        # Iterate through the provided path patterns
-        new_path = pattern
-        optional_patterns = re.findall('\[(.*?)\]', pattern)
-        # First build from optional patterns if possible
-        for optional_pattern in optional_patterns:
-            optional_chunk = replace_entities(entities, optional_pattern) or ''
-            new_path = new_path.replace('[%s]' % optional_pattern,
-                                        optional_chunk)
-        # Replace remaining entities
-        new_path = replace_entities(entities, new_path)
+        # Skip patterns that need entities we don't have
+        if required is not None and not required <= entities.keys():
+            continue
+
+        if tokens is not None:
+            new_path = _fill_tokens(tokens, entities)
+        else:
+            # Iterate through the provided path patterns
+            new_path = pattern
+            # First build from optional patterns if possible
+            for optional_pattern in optional_patterns:
+                optional_chunk = replace_entities(entities,
+                                                  optional_pattern) or ''
+                new_path = new_path.replace('[%s]' % optional_pattern,
+                                            optional_chunk)
+            # Replace remaining entities
+            new_path = replace_entities(entities, new_path)
 
         if new_path:
             return new_path
@@ -104,8 +243,112 @@ def build_path(entities, path_patterns, strict=False):
     return None
 
 
+def _fill_token_columns(tokens, entities, present):
+    ''' Column-wise version of _fill_tokens. Fills in a tokenized path
+    pattern for every row of the entities DataFrame at once, and returns a
+    (paths, ok) tuple of Series, where ok is False for rows in which a
+    placeholder can't be filled in. '''
+    import pandas as pd
+
+    paths = pd.Series('', index=entities.index, dtype=object)
+    ok = pd.Series(True, index=entities.index)
+    for tok in tokens:
+        if isinstance(tok, _Placeholder):
+            name, valid, default = tok
+            if name is None or (name not in entities and default is None):
+                return paths, ok & False
+            if name not in entities:
+                chunk = default
+            else:
+                has = present[name]
+                vals = entities[name].astype(str)
+                if valid is not None:
+                    ok &= ~has | vals.str.match(valid)
+                if default is None:
+                    ok &= has
+                chunk = vals.where(has, default or '')
+        elif isinstance(tok, _Optional):
+            sub_paths, sub_ok = _fill_token_columns(tok.tokens, entities,
+                                                    present)
+            chunk = sub_paths.where(sub_ok, '')
+        else:
+            chunk = tok
+        paths = paths + chunk
+    return paths, ok
+
+
+def build_paths(entities, path_patterns, strict=False):
+    """
+    Constructs paths for many sets of entities at once. Equivalent to calling
+    build_path() on each row of a pandas DataFrame, but fills in the patterns
+    one column at a time.
+
+    Args:
+        entities (DataFrame): A pandas DataFrame with entity names in columns
+            and one set of entity values per row (e.g., as returned by
+            Layout.as_data_frame(), minus the 'path' column). Missing values
+            (None/NaN) denote entities that aren't set for that row.
+        path_patterns (str, list): One or more filename patterns (see
+            build_path).
+        strict (bool): If True, all entities set for a row must be matched
+            inside a pattern in order to be a valid match (see build_path).
+
+    Returns:
+        A pandas Series of constructed paths, with the same index as the
+        passed DataFrame. Rows for which no pattern matches are None.
+    """
+    import pandas as pd
+
+    if isinstance(path_patterns, string_types):
+        path_patterns = [path_patterns]
+
+    parsed = [_parse_path_pattern(pattern) for pattern in path_patterns]
+    result = pd.Series([None] * len(entities), index=entities.index,
+                       dtype=object)
+
+    # Patterns that may replace invalid entity values with defaults change
+    # the entities seen by later patterns, so they're filled in row by row
+    if any(tokens is None for _, _, _, tokens in parsed):
+        for i, (_, row) in enumerate(entities.iterrows()):
+            ents = {k: v for k, v in row.items() if not pd.isnull(v)}
+            result.iat[i] = build_path(ents, path_patterns, strict)
+        return result
+
+    # Work on positions, in case the index has duplicate labels
+    index = entities.index
+    entities = entities.reset_index(drop=True)
+    result = result.reset_index(drop=True)
+    present = entities.notnull()
+    todo = pd.Series(True, index=entities.index)
+    for defined, _, required, tokens in parsed:
+        rows = todo.copy()
+        if strict:
+            extra = [c for c in entities.columns if c not in defined]
+            if extra:
+                rows &= ~present[extra].any(axis=1)
+        for name in required:
+            if name not in present:
+                rows[:] = False
+                break
+            rows &= present[name]
+        if not rows.any():
+            continue
+        paths, ok = _fill_token_columns(tokens, entities[rows],
+                                        present[rows])
+        done = ok & (paths != '')
+        done = done[done].index
+        result[done] = paths[done]
+        todo[done] = False
+        if not todo.any():
+            break
+
+    result.index = index
+    return result
+
+
 def write_contents_to_file(path, contents=None, link_to=None,
-                           content_mode='text', root=None, conflicts='fail'):
+                           content_mode='text', root=None, conflicts='fail',
+                           copy_from=None):
     """
     Uses provided filename patterns to write contents to a new path, given
     a corresponding entity map.
@@ -126,6 +369,10 @@ def write_contents_to_file(path, contents=None, link_to=None,
             exists. 'fail' raises an exception; 'skip' does nothing;
             'overwrite' overwrites the existing file; 'append' adds  a suffix
             to each file copy, starting with 1. Default is 'fail'.
+        copy_from (str): Optional path of an existing file to copy to the new
+            path. Used as an alternative to the contents argument, and takes
+            priority over it. The copy is done by the OS (e.g., with
+            sendfile on Linux) without reading the file into memory.
     """
 
     if root is None and not isabs(path):
@@ -134,7 +381,14 @@ def write_contents_to_file(path, contents=None, link_to=None,
     if root:
         path = join(root, path)
 
-    if exists(path) or islink(path):
+    # A single lstat() covers both existing files and (broken) symlinks
+    try:
+        os.lstat(path)
+        path_exists = True
+    except OSError:
+        path_exists = False
+
+    if path_exists:
         if conflicts == 'fail':
             msg = 'A file at path {} already exists.'
             raise ValueError(msg.format(path))
@@ -149,13 +403,15 @@ def write_contents_to_file(path, contents=None, link_to=None,
                 return
             os.remove(path)
         elif conflicts == 'append':
+            # List the directory once instead of probing each suffix on disk
+            existing = set(os.listdir(dirname(path) or os.curdir))
+            path_splits = splitext(path)
+            stem, extensions = path_splits[0], path_splits[1:]
             i = 1
             while i < sys.maxsize:
-                path_splits = splitext(path)
-                path_splits[0] = path_splits[0] + '_%d' % i
+                path_splits = [stem + '_%d' % i] + extensions
                 appended_filename = os.extsep.join(path_splits)
-                if not exists(appended_filename) and \
-                   not islink(appended_filename):
+                if basename(appended_filename) not in existing:
                     path = appended_filename
                     break
                 i += 1
@@ -163,13 +419,17 @@ def write_contents_to_file(path, contents=None, link_to=None,
             raise ValueError('Did not provide a valid conflicts parameter')
 
     if not exists(dirname(path)):
-        os.makedirs(dirname(path))
+        # Another writer may create the directory in the meantime
+        os.makedirs(dirname(path), exist_ok=True)
 
     if link_to:
         os.symlink(link_to, path)
+    elif copy_from:
+        shutil.copyfile(copy_from, path)
     elif contents:
         mode = 'wb' if content_mode == 'binary' else 'w'
         with open(path, mode) as f:
             f.write(contents)
     else:
-        raise ValueError('One of contents or link_to must be provided.')
+        raise ValueError('One of contents, copy_from or link_to must be '
+                         'provided.')
@@ -5,7 +5,7 @@ from os.path import join
 import posixpath as psp
 import tempfile
 import json
-from copy import copy
+from copy import copy, deepcopy
 
 
 DIRNAME = os.path.dirname(__file__)
@@ -133,6 +133,18 @@ class TestEntity:
         e.add_file('a', '1')
         assert e.files['a'] == '1'
 
+    def test_deepcopy(self):
+        class SlottedEntity(Entity):
+            __slots__ = ('extra',)
+
+        e = SlottedEntity('prop', r'-(\d+)')
+        e.add_file('a', '1')
+        e.extra = ['x']
+        e2 = deepcopy(e)
+        assert e2.pattern == e.pattern
+        assert e2.files == e.files and e2.files is not e.files
+        assert e2.extra == ['x'] and e2.extra is not e.extra
+
 
 class TestLayout:
 
@@ -163,6 +175,33 @@ class TestLayout:
         sub_file = join(root, "sub-01", "sub-01_sessions.tsv")
         assert sub_file in bids_layout.files
         assert sub_file not in layout.files
+        # Multiple regexes, including one with a backreference
+        layout = Layout([(root, config)], regex_search=True,
+                        exclude=[r'sub-\d*', r'(d)ataset_\1escription'])
+        assert target not in layout.files
+        assert sub_file not in layout.files
+        # Group references and inline flags only apply to their own regex
+        layout = Layout([(root, config)], regex_search=True,
+                        exclude=[r'(x)y', r'(d)?(?(1)ataset_description|zzz)'])
+        assert target not in layout.files
+        layout = Layout([(root, config)], regex_search=True,
+                        exclude=[r'SUB-\d*', r'(?i)zzz'])
+        assert sub_file in layout.files
+
+    def test_init_with_max_workers(self, bids_layout):
+        root = join(DIRNAME, 'data', '7t_trt')
+        config = join(DIRNAME, 'specs', 'test.json')
+        layout = Layout([(root, config)], regex_search=True, max_workers=4)
+        assert set(layout.files.keys()) == set(bids_layout.files.keys())
+
+    def test_init_with_extensions(self, bids_layout):
+        root = join(DIRNAME, 'data', '7t_trt')
+        config = join(DIRNAME, 'specs', 'test.json')
+        layout = Layout([(root, config)], extensions=['.nii.gz', '.tsv'])
+        expected = [f for f in bids_layout.files
+                    if f.endswith(('.nii.gz', '.tsv'))]
+        assert expected
+        assert set(layout.files.keys()) == set(expected)
 
     def test_init_with_config_options(self):
         root = join(DIRNAME, 'data')
@@ -274,6 +313,12 @@ class TestLayout:
             assert os.path.exists(join(bids_layout.root, result[0]))
             assert os.path.isdir(join(bids_layout.root, result[0]))
 
+        # Restricting the query to a domain gives the same directories
+        assert bids_layout.get(target='subject', return_type='dir',
+                               domains=['test']) == result
+        assert bids_layout.get(target='subject', return_type='dir',
+                               domains='test') == result
+
         result = bids_layout.get(target='subject', type='phasediff',
                                  return_type='file')
 
@@ -283,6 +328,47 @@ class TestLayout:
             assert all([os.path.exists(join(bids_layout.root, f))
                         for f in result])
 
+    def test_querying_value_index(self, bids_layout):
+        # Queries are narrowed down using the inverted value index; results
+        # must agree with a full scan of the Files.
+        queries = [{'subject': '01'}, {'subject': ['02', '03'], 'run': '1'},
+                   {'subject': '01', 'acquisition': None}, {'run': 1},
+                   {'subject': '1'}, {'nonexistent': 'x'},
+                   {'subject': '0[12]', 'run': [1, 2]}, {'session': '.*'},
+                   {'subject': []}, {'run': []}]
+        for regex_search in (False, True):
+            for q in queries:
+                result = bids_layout.get(return_type='obj',
+                                         regex_search=regex_search, **q)
+                expected = [f for f in bids_layout.files.values()
+                            if f._matches(q, regex_search=regex_search)]
+                assert [f.path for f in result] == \
+                    [f.path for f in expected]
+
+        # Empty lists of values match any file that has the entity
+        assert len(bids_layout.get(run=[])) == \
+            len([f for f in bids_layout.files.values() if 'run' in f.tags])
+
+        # The same filter gives the same results with and without regex
+        # search, whichever runs first
+        for q in ({'subject': []}, {'subject': ['01', '02']}):
+            exact = bids_layout.get(regex_search=False, **q)
+            assert bids_layout.get(regex_search=True, **q) == exact
+            assert bids_layout.get(regex_search=False, **q) == exact
+
+        # Repeated queries are memoized, but return independent lists
+        result = bids_layout.get(subject='01', return_type='file')
+        result.append('not-a-file')
+        assert bids_layout.get(subject='01', return_type='file') == \
+            result[:-1]
+
+        # The memos are bounded
+        for i in range(1100):
+            bids_layout.get(subject='0*%d' % i, regex_search=True)
+        _, _, hits, results = bids_layout._get_value_index()
+        assert len(hits) <= 1024
+        assert len(results) <= 256
+
     def test_natsort(self, bids_layout):
         result = bids_layout.get(target='subject', return_type='id')
         assert result[:5] == list(map("%02d".__mod__, range(1, 6)))
@@ -294,6 +380,16 @@ class TestLayout:
         assert bids_layout.count('run') == 2
         assert bids_layout.count('run', files=True) > 2
 
+    def test_as_data_frame(self, bids_layout):
+        pytest.importorskip('pandas')
+        df = bids_layout.as_data_frame()
+        assert len(df) == len(bids_layout.files)
+        assert df.columns[0] == 'path'
+        assert 'subject' in df.columns
+        df = bids_layout.as_data_frame(subject='01', run=1)
+        assert set(df['subject']) == {'01'}
+        assert set(df['run']) == {1}
+
     def test_get_nearest(self, bids_layout):
         result = bids_layout.get(
             subject='01', run=1, session=1, type='phasediff',
@@ -354,6 +450,29 @@ class TestLayout:
         assert bids_layout.unique('subject') == ['01']
         assert len(bids_layout.files) == 24
 
+    def test_init_with_index_cache(self, tmpdir):
+        root = join(DIRNAME, 'data', '7t_trt')
+        config = join(DIRNAME, 'specs', 'test.json')
+        index = join(str(tmpdir), 'index.json')
+        layout = Layout([(root, config)], index=index)
+        assert os.path.exists(index)
+        cached = Layout([(root, config)], index=index)
+        assert set(cached.files.keys()) == set(layout.files.keys())
+        assert cached.unique('subject') == layout.unique('subject')
+
+        # Indexes using directory-specific configs can't be reloaded, so
+        # they aren't saved
+        root = join(DIRNAME, 'data', 'valuable_stamps')
+        config = join(DIRNAME, 'specs', 'stamps.json')
+        index = join(str(tmpdir), 'stamps_index.json')
+        with pytest.warns(UserWarning):
+            layout = Layout([(root, config)], config_filename='dir_config.json',
+                            index=index)
+        assert not os.path.exists(index)
+        layout = Layout([(root, config)], config_filename='dir_config.json',
+                        index=index)
+        assert 'usa_stamps' in layout.domains
+
     def test_entity_mapper(self):
 
         class EntityMapper(object):
@@ -385,7 +504,12 @@ class TestLayout:
             layout = Layout([(root, config)], regex_search=True)
 
     def test_clone(self, bids_layout):
+        dirs = bids_layout.get(target='subject', return_type='dir')
         lc = bids_layout.clone()
+        # Derived caches aren't copied, but are rebuilt as needed
+        assert lc._value_index is None
+        assert not lc._dir_patterns and not lc._parsed_entities
+        assert lc.get(target='subject', return_type='dir') == dirs
         attrs = ['mandatory', 'dynamic_getters', 'regex_search',
                  'entity_mapper']
         for a in attrs:
@@ -433,6 +557,25 @@ class TestLayout:
         ents = bids_layout.parse_file_entities(filename, domains=['test'])
         assert ents == {'subject': '03', 'session': '7', 'run': 4,
                         'type': 'sekret'}
+        # Repeated calls are cached, but return independent dicts
+        ents['subject'] = '04'
+        ents = bids_layout.parse_file_entities(filename, domains=['test'])
+        assert ents['subject'] == '03'
+        # Cached or not, the parsed file is registered with the Layout
+        bids_layout.files.pop(filename)
+        bids_layout.parse_file_entities(filename, domains=['test'])
+        assert filename in bids_layout.files
+        bids_layout.files.pop(filename)
+
+    def test_parse_file_entities_after_reindex(self):
+        root = join(DIRNAME, 'data', '7t_trt')
+        config = join(DIRNAME, 'specs', 'test.json')
+        layout = Layout([(root, config)])
+        filename = join(root, 'sub-03', 'sub-03_ses-07_run-4_sekret.nii.gz')
+        layout.parse_file_entities(filename)
+        layout.index()
+        assert not layout._parsed_entities
+        assert filename not in layout.files
 
 
 def test_merge_layouts(bids_layout, stamp_layout):
@@ -3,7 +3,7 @@ from grabbit import Layout, File, Tag
 from grabbit.extensions.writable import build_path
 import os
 import shutil
-from os.path import join, exists, islink, dirname
+from os.path import join, exists, islink, dirname, relpath
 
 
 @pytest.fixture
@@ -106,6 +106,8 @@ class TestWritableFile:
         target = join(writable_file.dirname, 'rest/sub-3/run-2.nii.gz')
         writable_file.copy(pat)
         assert exists(target)
+        with open(target) as f:
+            assert f.read() == '###'
 
         # Conflict handling
         with pytest.raises(ValueError):
@@ -182,11 +184,34 @@ class TestWritableLayout:
         assert exists(example_file)
         assert exists(example_file2)
 
+    def test_write_files_with_max_workers(self, tmpdir, layout):
+        written = {}
+        for max_workers in (None, 4):
+            out_dir = str(tmpdir.mkdir('workers-%s' % max_workers))
+            pat = join(out_dir, 'sub-{subject}'
+                                '/sess-{session}'
+                                '/r-{run}'
+                                '/type-{type}'
+                                '/task-{task}.nii.gz')
+            layout.max_workers = max_workers
+            layout.copy_files(path_patterns=pat, conflicts='append')
+            written[max_workers] = sorted(
+                relpath(join(d, f), out_dir)
+                for d, _, fs in os.walk(out_dir) for f in fs)
+        assert written[4]
+        assert written[4] == written[None]
+
+        # A conflict on one worker stops the whole copy
+        pat = join(str(tmpdir), 'conflicts', 'sub-{subject}.nii.gz')
+        with pytest.raises(ValueError):
+            layout.copy_files(path_patterns=pat, conflicts='fail')
+
     def test_write_contents_to_file(self, layout):
         contents = 'test'
         data_dir = join(dirname(__file__), 'data', '7t_trt')
         entities = {'subject': 'Bob', 'session': '01'}
         pat = join('sub-{subject}/sess-{session}/desc.txt')
+        n_files = len(layout.get(return_type='file'))
 
         # With indexing
         layout.write_contents_to_file(entities, path_patterns=pat,
@@ -197,6 +222,8 @@ class TestWritableLayout:
             written = f.read()
         assert written == contents
         assert target in layout.files
+        # Memoized query results must not survive indexing new files
+        assert len(layout.get(return_type='file')) == n_files + 1
         shutil.rmtree(join(data_dir, 'sub-Bob'))
 
         # Without indexing
@@ -246,3 +273,21 @@ class TestWritableLayout:
         file = join('sub-04', 'ses-1', 'func', filename)
         path = layout.build_path(file, path_patterns=pat)
         assert path.endswith('sub-04/sess-1/r-1.nii.gz')
+
+    def test_build_paths(self, tmpdir, layout):
+        pytest.importorskip('pandas')
+        pats = [join(str(tmpdir), 'sub-{subject<01|02>}/[ses-{session}/]'
+                     'run-{run}_{type}.nii.gz'),
+                join(str(tmpdir), 'sub-{subject}/{type|unknown}.nii.gz')]
+        paths = layout.build_paths(path_patterns=pats)
+        files = list(layout.files.values())
+        assert len(paths) == len(files)
+        for f, path in zip(files, paths):
+            assert path == layout.build_path(f, path_patterns=pats)
+
+        df = layout.as_data_frame(subject='01')
+        paths = layout.build_paths(df, pats)
+        assert list(paths.index) == list(df.index)
+        for (_, row), path in zip(df.drop('path', axis=1).iterrows(), paths):
+            entities = row[row.notnull()].to_dict()
+            assert path == build_path(entities, pats)
@@ -1,33 +1,85 @@
 import os
 import re
 
-from os.path import join, dirname, basename
+from os.path import join, split
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+
+# Runs of digits, kept (as every other chunk) when splitting on them
+_DIGITS = re.compile('([0-9]+)')
 
 
 def natural_sort(l, field=None):
     '''
     based on snippet found at http://stackoverflow.com/a/4836734/2445984
     '''
-    convert = lambda text: int(text) if text.isdigit() else text.lower()
+    split = _DIGITS.split
 
     def alphanum_key(key):
         if field is not None:
             key = getattr(key, field)
         if not isinstance(key, str):
             key = str(key)
-        return [convert(c) for c in re.split('([0-9]+)', key)]
+        # Text and digits alternate, so every odd chunk is a number
+        chunks = split(key.lower())
+        chunks[1::2] = map(int, chunks[1::2])
+        return chunks
     return sorted(l, key=alphanum_key)
 
 
+def compile_regex(pattern):
+    ''' Compiles a regex pattern, preferring the linear-time re2 engine when
+    it is installed. Falls back to the standard library's re module if re2 is
+    unavailable or does not support the pattern (e.g., backreferences or
+    lookaround assertions). '''
+    if re2 is not None:
+        try:
+            return re2.compile(pattern)
+        except re2.error:
+            pass
+    return re.compile(pattern)
+
+
+def literal_prefix(pattern):
+    ''' Returns the literal text that every match of a regex pattern must
+    start with, or an empty string if no such prefix can be determined. This
+    is cheap to test for with the `in` operator before running the pattern.
+    '''
+    if '|' in pattern:
+        return ''
+    prefix = []
+    for c in pattern:
+        if c in '*?{':
+            # The preceding character is optional or repeated
+            prefix = prefix[:-1]
+            break
+        if c in '.^$+}[]()\\':
+            break
+        prefix.append(c)
+    return ''.join(prefix)
+
+
+def has_leading_wildcard(pattern):
+    ''' Returns True if a regex pattern starts with '.*' (possibly inside one
+    or more groups). For such patterns, any match that re.search would find
+    can also be found by re.match at the start of the string (as long as the
+    string contains no newlines), which avoids retrying the pattern at every
+    position when there is no match. '''
+    if '|' in pattern:
+        return False
+    return pattern.lstrip('(').startswith('.*')
+
+
 def splitext(path):
     """splitext for paths with directories that may contain dots.
     From https://stackoverflow.com/questions/5930036/separating-file-extensions-using-python-os-path-module"""
-    li = []
-    path_without_extensions = join(dirname(path), basename(path).split(os.extsep)[0])
-    extensions = basename(path).split(os.extsep)[1:]
-    li.append(path_without_extensions)
-    # li.append(extensions) if you want extensions in another list inside the list that is returned.
-    li.extend(extensions)
+    head, tail = split(path)
+    li = tail.split(os.extsep)
+    li[0] = join(head, li[0])
     return li
 
 
@@ -1,34 +1,54 @@
-import sys
-from setuptools import setup, find_packages
-import versioneer
-
-if len(set(('test', 'easy_install')).intersection(sys.argv)) > 0:
-    import setuptools
+import json
+import re
+from setuptools import setup
 
 tests_require = ["pytest>=3.3.0"]
 
-VERSION=versioneer.get_version()
+
+def get_version_and_cmdclass():
+    """ Returns the version and setup() cmdclass. Source distributions ship
+    a static grabbit/_version.py with the version baked in, in which case
+    versioneer (and the git calls it makes) can be skipped entirely. """
+    try:
+        with open('grabbit/_version.py') as f:
+            contents = f.read()
+    except (IOError, OSError):
+        contents = ''
+    match = re.search(r"version_json = '''\r?\n(.*)'''  # END VERSION_JSON",
+                      contents, re.M | re.S)
+    if match:
+        return json.loads(match.group(1))['version'], {}
+    import versioneer
+    return versioneer.get_version(), versioneer.get_cmdclass()
+
+
+VERSION, CMDCLASS = get_version_and_cmdclass()
 
 setup(
     name="grabbit",
     version=VERSION,
-    cmdclass=versioneer.get_cmdclass(),
+    cmdclass=CMDCLASS,
     description="get grabby with file trees",
     maintainer='Tal Yarkoni',
     maintainer_email='tyarkoni@gmail.com',
     url='http://github.com/grabbles/grabbit',
-    packages=find_packages(),
+    packages=['grabbit', 'grabbit.extensions', 'grabbit.external',
+              'grabbit.tests'],
     include_package_data=True,
+    python_requires='>=3.7',
     install_requires=[],
     tests_require=tests_require,
+    extras_require={'tests': tests_require},
     license='MIT',
     download_url='http://github.com/grabbles/grabbit/archive/%s.tar.gz' % VERSION,
     classifiers=[
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ]
 )